@@ -6,22 +6,135 @@ Converts MusicXML files to JSON format according to json-spec.md specification.
 Handles partwise format, backup/forward elements, ties, and chord processing.
 """
 
-import xml.etree.ElementTree as ET
 import json
+import mmap
 import sys
+import numpy as np
 from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+
+# Prefer lxml's libxml2-backed parser when available; it is considerably
+# faster on large scores and iterparse is a drop-in replacement.
+try:
+    from lxml import etree as ET
+    # Before 5.0, lxml resolves external entities by default, which expat
+    # never does; use ElementTree rather than risk reading local files.
+    if ET.LXML_VERSION < (5, 0):
+        raise ImportError("lxml 5.0 or later is required")
+    HAVE_LXML = True
+    # Whitespace, comments and processing instructions are never consulted,
+    # so don't materialize them. Entities keep lxml's default (5.0+):
+    # like expat, those declared in the internal DTD subset are expanded
+    # and external ones are not loaded.
+    ITERPARSE_OPTIONS = {
+        'remove_blank_text': True,
+        'remove_comments': True,
+        'remove_pis': True,
+        'huge_tree': False,
+    }
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
+    ITERPARSE_OPTIONS = {}
+
+# Likewise prefer orjson for serializing the output when it is installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Number of notes encoded per write in save_json
+NOTES_PER_WRITE = 1024
+
+
+def encode_json(data) -> bytes:
+    """Serialize data as indented UTF-8 JSON, keeping non-ASCII characters as is."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def dumps_json(data: Dict) -> str:
+    """Serialize data as indented JSON, keeping non-ASCII characters as is."""
+    return encode_json(data).decode('utf-8')
+
+
+def save_json(data: Dict, output_file: str):
+    """Write data to output_file as indented UTF-8 JSON.
+
+    The notes are encoded and written in batches, so the whole document is
+    never held in memory as a single string. The output is the same as
+    encoding data in one go.
+    """
+    with open(output_file, 'wb') as f:
+        f.write(b'{')
+        separator = b'\n'
+        for key, value in data.items():
+            f.write(separator + b'  ' + encode_json(key) + b': ')
+            separator = b',\n'
+            if key == 'notes' and value:
+                # Encode a batch of notes at a time and splice the batches
+                # into one array. String values never contain raw newlines,
+                # so replacing them only re-indents.
+                f.write(b'[')
+                for start in range(0, len(value), NOTES_PER_WRITE):
+                    chunk = encode_json(value[start:start + NOTES_PER_WRITE])
+                    if start:
+                        f.write(b',')
+                    # Drop the batch's own "[" and "\n]"
+                    f.write(chunk[1:-2].replace(b'\n', b'\n  '))
+                f.write(b'\n  ]')
+            else:
+                f.write(encode_json(value).replace(b'\n', b'\n  '))
+        f.write(b'\n}')
+
+
+def iterparse_file(xml_file: str, events: Tuple[str, ...]):
+    """Iterate over (event, element) pairs while parsing xml_file.
+
+    lxml is given the path and reads the file itself in C. The ElementTree
+    fallback reads from a read-only memory map instead of a buffered file,
+    so the file is paged in on demand without extra read calls.
+    """
+    if HAVE_LXML:
+        yield from ET.iterparse(xml_file, events=events, **ITERPARSE_OPTIONS)
+        return
+    
+    with open(xml_file, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty and non-regular files can't be mapped; read them as usual
+            yield from ET.iterparse(f, events=events)
+            return
+        with mapped:
+            yield from ET.iterparse(mapped, events=events)
+
+
+# Semitone offset from C for each step, indexed by ord(step) - ord('A')
+STEP_SEMITONES = (9, 11, 0, 2, 4, 5, 7)  # A B C D E F G
 
 
-@dataclass
 class Note:
-    """Represents a musical note with timing and pitch information."""
-    pitch: int  # MIDI note number
-    beat: float  # Start position in quarter notes
-    duration: float  # Length in quarter notes
-    velocity: int = 80
-    voice: str = "1"
-    staff: int = 1
+    """Represents a musical note with timing and pitch information.
+
+    Uses __slots__ instead of a per-instance __dict__, since a score can hold
+    tens of thousands of notes.
+    """
+    __slots__ = ("pitch", "beat", "duration", "velocity", "voice", "staff")
+
+    def __init__(self, pitch: int, beat: float, duration: float,
+                 velocity: int = 80, voice: str = "1", staff: int = 1):
+        self.pitch = pitch  # MIDI note number
+        self.beat = beat  # Start position in quarter notes
+        self.duration = duration  # Length in quarter notes
+        self.velocity = velocity
+        self.voice = voice
+        self.staff = staff
+
+    def __repr__(self) -> str:
+        return (f"Note(pitch={self.pitch}, beat={self.beat}, duration={self.duration}, "
+                f"velocity={self.velocity}, voice={self.voice!r}, staff={self.staff})")
 
 
 class MusicXMLConverter:
@@ -29,101 +142,93 @@ class MusicXMLConverter:
     
     def __init__(self):
         self.divisions = 24  # Default divisions per quarter note
+        self._inv_divisions = 1.0 / self.divisions  # Cached for duration_to_beats
         self.current_beat = 0.0
-        self.notes = []
-        self.active_ties = {}  # Track active ties by (pitch, voice, staff)
+        self.reset_notes()
+        self.active_ties = {}  # Index of the tied note by (voice key, pitch)
+        self.voice_ids = {}  # Small integer id for each voice name seen
         self.chord_start_beat = 0.0  # Track the start beat of current chord
         self.voice_beats = {}  # Track beat position for each voice independently
         
+    def reset_notes(self):
+        """Clear the collected notes.
+
+        Notes are stored as parallel per-field lists (one entry per note)
+        rather than as Note objects, so the output pass can work on whole
+        arrays of beats and durations.
+        """
+        self.pitches = []
+        self.beats = []
+        self.durations = []
+        self.velocities = []
+    
+    def add_note(self, note: Note):
+        """Append a note to the collected note lists."""
+        self.pitches.append(note.pitch)
+        self.beats.append(note.beat)
+        self.durations.append(note.duration)
+        self.velocities.append(note.velocity)
+        
     def pitch_to_midi(self, step: str, alter: int, octave: int) -> int:
         """Convert MusicXML pitch to MIDI note number."""
-        # Map note names to semitone offsets
-        note_map = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
-        
-        # Calculate MIDI note number
-        midi_note = (octave + 1) * 12 + note_map[step] + alter
-        return midi_note
+        return (octave + 1) * 12 + STEP_SEMITONES[ord(step) - 65] + alter
     
     def duration_to_beats(self, duration: int) -> float:
         """Convert MusicXML duration to quarter note beats."""
-        return duration / self.divisions
+        return duration * self._inv_divisions
 
-    def round_beat(self, beat: float) -> float:
-        """Round beat value to remove floating point errors.
+    def round_beats(self, beats: np.ndarray) -> np.ndarray:
+        """Round beat values to remove floating point errors.
 
-        Rounds to the nearest common fraction:
+        Rounds each value to the nearest common fraction:
         - Integer (1.0, 2.0, etc.)
         - Half (0.5, 1.5, etc.)
         - Quarter (0.25, 0.75, 1.25, etc.)
 
-        If none of these are close enough, returns the original value.
+        Values that are not close enough to any of these are kept as is.
+
+        Integers and halves lie on the quarter grid, and anything within the
+        tolerance of one is also nearest to it on that grid. So a single
+        snap to the quarter grid gives the same result as trying each
+        fraction in turn, in one fused pass without nested np.where calls.
         """
-        # Try rounding to integer
-        rounded = round(beat)
-        if abs(beat - rounded) < 0.0001:
-            return float(rounded)
-
-        # Try rounding to 0.5
-        half_rounded = round(beat * 2) / 2
-        if abs(beat - half_rounded) < 0.0001:
-            return half_rounded
-
-        # Try rounding to 0.25
-        quarter_rounded = round(beat * 4) / 4
-        if abs(beat - quarter_rounded) < 0.0001:
-            return quarter_rounded
-
-        # Return original value if no close match
-        return beat
+        rounded = beats * 4
+        np.round(rounded, out=rounded)
+        rounded /= 4
+
+        # Fall back to the original value if no close match
+        return np.where(np.abs(beats - rounded) < 0.0001, rounded, beats)
     
-    def process_note_element(self, note_elem) -> Optional[Note]:
-        """Process a single note element from MusicXML."""
-        # Get voice and staff first for timing calculations
-        voice_elem = note_elem.find('voice')
-        voice = voice_elem.text if voice_elem is not None else "1"
-        
-        staff_elem = note_elem.find('staff')
-        staff = int(staff_elem.text) if staff_elem is not None else 1
-        
-        # Get duration (needed for both notes and rests)
-        duration_elem = note_elem.find('duration')
-        if duration_elem is None:
-            return None
-        duration = int(duration_elem.text)
-        duration_beats = self.duration_to_beats(duration)
-        
+    def process_note_element(self, children: Dict, beat: float, duration_beats: float,
+                             voice: str, staff: int) -> Optional[Note]:
+        """Create a Note from a note element's children.
+
+        Voice, staff, duration and beat position are read once by
+        process_measure and passed in. Returns None for rests and unpitched notes.
+        """
         # Check if this is a rest
-        if note_elem.find('rest') is not None:
+        if 'rest' in children:
             # For rests, we still need to advance the timing but don't create a note
             return None
             
         # Get pitch information
-        pitch_elem = note_elem.find('pitch')
+        pitch_elem = children.get('pitch')
         if pitch_elem is None:
             return None
-            
-        step = pitch_elem.find('step').text
-        alter_elem = pitch_elem.find('alter')
+        
+        pitch_children = {child.tag: child for child in pitch_elem}
+        step = pitch_children['step'].text
+        alter_elem = pitch_children.get('alter')
         alter = int(alter_elem.text) if alter_elem is not None else 0
-        octave = int(pitch_elem.find('octave').text)
+        octave = int(pitch_children['octave'].text)
         
         # Convert to MIDI note number
         midi_pitch = self.pitch_to_midi(step, alter, octave)
         
-        # Check if this is a chord note (starts at same time as previous note)
-        is_chord = note_elem.find('chord') is not None
-        
-        # Calculate beat position using voice-specific timing
-        voice_key = f"{voice}_{staff}"
-        if voice_key not in self.voice_beats:
-            self.voice_beats[voice_key] = self.current_beat
-            
-        beat_position = self.voice_beats[voice_key]
-        
         # Create note object
         note = Note(
             pitch=midi_pitch,
-            beat=beat_position,
+            beat=beat,
             duration=duration_beats,
             voice=voice,
             staff=staff
@@ -131,21 +236,18 @@ class MusicXMLConverter:
         
         return note
     
-    def process_tie(self, note_elem, note: Note):
+    def process_tie(self, note: Note, voice_key: int, tie_start: bool, tie_stop: bool):
         """Process tie elements for the note."""
-        tie_key = (note.pitch, note.voice, note.staff)
+        # MIDI pitch fits in the low 8 bits below the voice key
+        tie_key = (voice_key << 8) | note.pitch
         
         # Check for tie stop first
-        tie_stop = note_elem.find('.//tie[@type="stop"]')
-        tie_start = note_elem.find('.//tie[@type="start"]')
-        
-        if tie_stop is not None and tie_key in self.active_ties:
+        if tie_stop and tie_key in self.active_ties:
             # Extend the duration of the tied note
-            tied_note = self.active_ties[tie_key]
-            tied_note.duration += note.duration
+            self.durations[self.active_ties[tie_key]] += note.duration
             
             # Check if this note also starts a new tie
-            if tie_start is not None:
+            if tie_start:
                 # This note continues the tie, keep the reference
                 pass
             else:
@@ -155,72 +257,117 @@ class MusicXMLConverter:
             return False  # Don't add this note separately
         
         # Check for tie start (only if not already processed as tie stop)
-        if tie_start is not None:
-            self.active_ties[tie_key] = note
+        if tie_start:
+            # The note is added right after this, at the end of the lists
+            self.active_ties[tie_key] = len(self.pitches)
             
         return True  # Add this note
     
+    def start_part(self):
+        """Reset the per-part parsing state.
+
+        Parts are processed independently: beat counters, voice timing and
+        open ties never carry over from the previous part.
+        """
+        self.current_beat = 0.0
+        self.chord_start_beat = 0.0
+        self.voice_beats = {}
+        self.active_ties = {}
+    
     def process_measure(self, measure_elem):
         """Process a single measure from MusicXML."""
         measure_start_beat = self.current_beat
         measure_duration = 0.0  # Track the longest duration in this measure
         
+        # Hoist per-measure invariants into locals for the note loop
+        voice_beats = self.voice_beats
+        voice_ids = self.voice_ids
+        inv_divisions = self._inv_divisions
+        
         for elem in measure_elem:
-            if elem.tag == 'attributes':
-                # Update divisions if specified
-                divisions_elem = elem.find('divisions')
-                if divisions_elem is not None:
-                    self.divisions = int(divisions_elem.text)
-                    
-            elif elem.tag == 'note':
+            tag = elem.tag
+            if tag == 'note':
+                # Collect the child elements once; they are shared with
+                # process_note_element instead of being looked up again.
+                # <tie> is always a direct child of <note> (the <tied> marks
+                # under <notations> are notation only), so ties are picked up
+                # in the same pass. A note may both stop and start a tie.
+                children = {}
+                tie_start = tie_stop = False
+                for child in elem:
+                    child_tag = child.tag
+                    if child_tag == 'tie':
+                        tie_type = child.get('type')
+                        if tie_type == 'start':
+                            tie_start = True
+                        elif tie_type == 'stop':
+                            tie_stop = True
+                    else:
+                        children[child_tag] = child
+                
                 # Get voice and staff for timing management
-                voice_elem = elem.find('voice')
+                voice_elem = children.get('voice')
                 voice = voice_elem.text if voice_elem is not None else "1"
-                staff_elem = elem.find('staff')
+                staff_elem = children.get('staff')
                 staff = int(staff_elem.text) if staff_elem is not None else 1
-                voice_key = f"{voice}_{staff}"
+                
+                # Pack voice and staff into one int key, (staff << 8) | voice_id,
+                # with voice names interned to small ids
+                voice_id = voice_ids.get(voice)
+                if voice_id is None:
+                    voice_id = voice_ids[voice] = len(voice_ids)
+                voice_key = (staff << 8) | voice_id
                 
                 # Get duration for timing advancement
-                duration_elem = elem.find('duration')
+                duration_elem = children.get('duration')
                 if duration_elem is not None:
-                    duration = int(duration_elem.text)
-                    duration_beats = self.duration_to_beats(duration)
+                    duration_beats = int(duration_elem.text) * inv_divisions
                 else:
                     duration_beats = 0
                 
                 # Check if this is a chord note before processing
-                is_chord = elem.find('chord') is not None
+                is_chord = 'chord' in children
                 
                 # Initialize voice timing if not exists
-                if voice_key not in self.voice_beats:
-                    self.voice_beats[voice_key] = self.current_beat
+                if voice_key not in voice_beats:
+                    voice_beats[voice_key] = self.current_beat
                 
                 # If this is not a chord note, update the chord start beat
                 if not is_chord:
-                    self.chord_start_beat = self.voice_beats[voice_key]
+                    self.chord_start_beat = voice_beats[voice_key]
                 
-                note = self.process_note_element(elem)
+                # Notes without a duration (e.g. grace notes) are skipped.
+                # Chord notes share the chord start beat, which for other
+                # notes is the voice's current position.
+                note = None
+                if duration_elem is not None:
+                    note = self.process_note_element(
+                        children, self.chord_start_beat, duration_beats, voice, staff
+                    )
                 if note is not None:
-                    # For chord notes, use the chord start beat
-                    if is_chord:
-                        note.beat = self.chord_start_beat
-                    
                     # Process ties
-                    should_add = self.process_tie(elem, note)
+                    should_add = self.process_tie(note, voice_key, tie_start, tie_stop)
                     
                     if should_add:
-                        self.notes.append(note)
+                        self.add_note(note)
                 
                 # Update voice timing (for both notes and rests, but not for chord notes)
                 if not is_chord:
-                    self.voice_beats[voice_key] += duration_beats
+                    voice_beats[voice_key] += duration_beats
                     # Update global current_beat to the maximum of all voices
-                    self.current_beat = max(self.voice_beats.values())
+                    self.current_beat = max(voice_beats.values())
                     # Track measure duration
                     current_position = self.current_beat - measure_start_beat
                     measure_duration = max(measure_duration, current_position)
+                    
+            elif tag == 'attributes':
+                # Update divisions if specified
+                divisions_elem = elem.find('divisions')
+                if divisions_elem is not None:
+                    self.divisions = int(divisions_elem.text)
+                    self._inv_divisions = inv_divisions = 1.0 / self.divisions
                         
-            elif elem.tag == 'backup':
+            elif tag == 'backup':
                 # Move beat counter backward
                 duration_elem = elem.find('duration')
                 if duration_elem is not None:
@@ -231,7 +378,7 @@ class MusicXMLConverter:
                     # Reset voice_beats for new voices that will start after backup
                     # But keep existing voice timing intact
                     
-            elif elem.tag == 'forward':
+            elif tag == 'forward':
                 # Move beat counter forward
                 duration_elem = elem.find('duration')
                 if duration_elem is not None:
@@ -245,49 +392,64 @@ class MusicXMLConverter:
     
     def convert_file(self, xml_file: str, output_file: str = None) -> Dict:
         """Convert MusicXML file to JSON format."""
-        # Parse XML
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        
         # Reset state
         self.current_beat = 0.0
-        self.notes = []
+        self.reset_notes()
         self.active_ties = {}
+        self.voice_ids = {}
         self.voice_beats = {}
         
-        # Get title from work element or use filename
+        # Stream the document instead of building the whole tree: each
+        # measure is processed as soon as it closes and then discarded,
+        # so memory stays bounded by a single measure.
         title = "Untitled"
-        work_elem = root.find('work')
-        if work_elem is not None:
-            work_title = work_elem.find('work-title')
-            if work_title is not None:
-                title = work_title.text
-        
-        # Process all parts (usually just one for piano)
-        for part in root.findall('part'):
-            # Reset beat counter for each part
-            self.current_beat = 0.0
-            self.voice_beats = {}
+        work_seen = False
+        depth = 0  # Nesting level of the current element; the root is 1
+        part = None
+        for event, elem in iterparse_file(xml_file, ("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                depth += 1
+                if tag == 'part':
+                    part = elem
+                    self.start_part()
+                continue
             
-            # Process all measures in the part
-            for measure in part.findall('measure'):
-                self.process_measure(measure)
+            depth -= 1
+            if tag == 'measure':
+                self.process_measure(elem)
+                elem.clear()
+                if part is not None:
+                    part.remove(elem)
+            elif tag == 'part':
+                part = None
+            elif tag == 'work' and depth == 1 and not work_seen:
+                # Get title from the root's first work element, if any
+                work_seen = True
+                work_title = elem.find('work-title')
+                if work_title is not None:
+                    title = work_title.text
         
-        # Convert notes to JSON format
-        json_notes = []
-        for note in self.notes:
-            json_note = {
-                "pitch": note.pitch,
+        # Round timings in bulk, then emit notes sorted by beat position
+        beats = self.round_beats(np.asarray(self.beats, dtype=np.float64))
+        durations = self.round_beats(np.asarray(self.durations, dtype=np.float64))
+        order = np.argsort(beats, kind="stable").tolist()
+        beats = beats.tolist()
+        durations = durations.tolist()
+        pitches = self.pitches
+        velocities = self.velocities
+        
+        json_notes = [
+            {
+                "pitch": pitches[i],
                 "timing": {
-                    "beat": self.round_beat(note.beat),
-                    "duration": self.round_beat(note.duration)
+                    "beat": beats[i],
+                    "duration": durations[i]
                 },
-                "velocity": note.velocity
+                "velocity": velocities[i]
             }
-            json_notes.append(json_note)
-        
-        # Sort notes by beat position
-        json_notes.sort(key=lambda x: x["timing"]["beat"])
+            for i in order
+        ]
         
         # Create final JSON structure
         result = {
@@ -298,8 +460,7 @@ class MusicXMLConverter:
         
         # Write to file if specified
         if output_file:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, ensure_ascii=False)
+            save_json(result, output_file)
         
         return result
 
@@ -320,7 +481,7 @@ def main():
         if output_file:
             print(f"Converted {input_file} to {output_file}")
         else:
-            print(json.dumps(result, indent=2, ensure_ascii=False))
+            print(dumps_json(result))
             
     except Exception as e:
         print(f"Error converting file: {e}")
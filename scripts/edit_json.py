@@ -10,8 +10,14 @@ json-spec.md形式のJSONファイルを編集するツール
 import json
 import sys
 import argparse
+from bisect import bisect_left, bisect_right
 from typing import Dict, List, Optional
-from copy import deepcopy
+
+# orjsonがあれば使用する（C実装で高速）。なければ標準のjsonを使用する
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class SongEditor:
@@ -20,13 +26,21 @@ class SongEditor:
     def __init__(self, song_data: Dict):
         """
         Args:
-            song_data: json-spec.md形式の楽曲データ
+            song_data: json-spec.md形式の楽曲データ（読み取りのみで変更しない）
         """
-        self.song_data = deepcopy(song_data)
+        self.song_data = song_data
         self.title = song_data.get("title", "Untitled")
         self.bpm = song_data.get("bpm", 120)
         self.notes = song_data.get("notes", [])
 
+        # 範囲抽出用のインデックス（必要になったときに作成してキャッシュする）
+        self._beats_sorted = None  # notesがbeat順に並んでいるか
+        self._beat_order = None  # beat順でない場合のみ作成
+        self._sorted_beats = None
+        self._pitch_filtered = False  # filter_by_pitchが呼ばれたことがあるか
+        self._pitch_order = None  # 2回目以降のfilter_by_pitchで作成
+        self._sorted_pitches = None
+
     def extract_measures(self, start_measure: int, end_measure: int, beats_per_measure: int = 4) -> Dict:
         """
         指定した小節範囲を抽出
@@ -43,15 +57,12 @@ class SongEditor:
         start_beat = (start_measure - 1) * beats_per_measure
         end_beat = end_measure * beats_per_measure
 
-        # 範囲内の音符を抽出
+        # 範囲内の音符を二分探索で切り出す
         extracted_notes = []
-        for note in self.notes:
-            note_beat = note["timing"]["beat"]
-            if start_beat <= note_beat < end_beat:
-                # 新しい音符を作成（beat位置を調整）
-                new_note = deepcopy(note)
-                new_note["timing"]["beat"] = note_beat - start_beat
-                extracted_notes.append(new_note)
+        for note in self._notes_in_beat_range(start_beat, end_beat):
+            # 新しい音符を作成（beat位置を調整、元の音符は変更しない）
+            new_note = {**note, "timing": {**note["timing"], "beat": note["timing"]["beat"] - start_beat}}
+            extracted_notes.append(new_note)
 
         # 結果を作成
         result = {
@@ -73,18 +84,7 @@ class SongEditor:
         Returns:
             フィルタリングされた楽曲データ
         """
-        filtered_notes = []
-
-        for note in self.notes:
-            pitch = note["pitch"]
-
-            # 音高範囲チェック
-            if min_pitch is not None and pitch < min_pitch:
-                continue
-            if max_pitch is not None and pitch > max_pitch:
-                continue
-
-            filtered_notes.append(deepcopy(note))
+        filtered_notes = self._notes_in_pitch_range(min_pitch, max_pitch)
 
         # タイトルを更新
         title_suffix = []
@@ -103,6 +103,47 @@ class SongEditor:
 
         return result
 
+    def _notes_in_beat_range(self, start_beat: float, end_beat: float) -> List[Dict]:
+        """start_beat以上end_beat未満の音符を元の並び順で返す"""
+        if self._beats_sorted is None:
+            beats = [note["timing"]["beat"] for note in self.notes]
+            self._beats_sorted = all(a <= b for a, b in zip(beats, beats[1:]))
+
+        # conv.pyの出力はbeat順に並んでいるので、notesをそのまま二分探索する
+        if self._beats_sorted:
+            lo = bisect_left(self.notes, start_beat, key=lambda note: note["timing"]["beat"])
+            hi = bisect_left(self.notes, end_beat, lo, key=lambda note: note["timing"]["beat"])
+            return self.notes[lo:hi]
+
+        # 手で編集されたbeat順でないデータのみ、beat順のインデックスを作成する
+        if self._beat_order is None:
+            self._beat_order = sorted(range(len(self.notes)), key=lambda i: self.notes[i]["timing"]["beat"])
+            self._sorted_beats = [self.notes[i]["timing"]["beat"] for i in self._beat_order]
+        lo = bisect_left(self._sorted_beats, start_beat)
+        hi = bisect_left(self._sorted_beats, end_beat)
+        return [self.notes[i] for i in sorted(self._beat_order[lo:hi])]
+
+    def _notes_in_pitch_range(self, min_pitch: Optional[int], max_pitch: Optional[int]) -> List[Dict]:
+        """指定した音高範囲の音符を元の並び順で返す（音符は変更しないのでそのまま共有する）"""
+        # 1回目は線形走査する（インデックスの作成より速い）
+        if not self._pitch_filtered:
+            self._pitch_filtered = True
+            return [
+                note for note in self.notes
+                if (min_pitch is None or note["pitch"] >= min_pitch)
+                and (max_pitch is None or note["pitch"] <= max_pitch)
+            ]
+
+        # 繰り返し呼ばれる場合は音高順のインデックスを作成してキャッシュし、二分探索する
+        if self._pitch_order is None:
+            self._pitch_order = sorted(range(len(self.notes)), key=lambda i: self.notes[i]["pitch"])
+            self._sorted_pitches = [self.notes[i]["pitch"] for i in self._pitch_order]
+        lo = 0 if min_pitch is None else bisect_left(self._sorted_pitches, min_pitch)
+        hi = len(self._sorted_pitches) if max_pitch is None else bisect_right(self._sorted_pitches, max_pitch)
+
+        # 元の並び順に戻す
+        return [self.notes[i] for i in sorted(self._pitch_order[lo:hi])]
+
     def filter_right_hand(self, threshold: int = 60) -> Dict:
         """
         右手パート（高音部）のみを抽出
@@ -134,12 +175,19 @@ class SongEditor:
 
 def load_json(file_path: str) -> Dict:
     """JSONファイルを読み込む"""
+    if orjson is not None:
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
     with open(file_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 
 def save_json(data: Dict, file_path: str):
     """JSONファイルに保存"""
+    if orjson is not None:
+        with open(file_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
 
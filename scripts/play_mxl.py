@@ -3,10 +3,9 @@
 MXLファイルを再生するスクリプト
 """
 
+import io
 import sys
 import os
-import tempfile
-import time
 from pathlib import Path
 
 def install_requirements():
@@ -35,43 +34,46 @@ def play_mxl_file(file_path: str):
         score = converter.parse(file_path)
         print(f"✓ Loaded: {score.metadata.title if score.metadata and score.metadata.title else 'Untitled'}")
         
-        # 一時MIDIファイルを作成
-        with tempfile.NamedTemporaryFile(suffix='.mid', delete=False) as temp_file:
-            temp_midi_path = temp_file.name
+        # MIDIに変換（一時ファイルを使わずメモリ上に書き出す）
+        print("Converting to MIDI...")
+        midi_file = midi.translate.music21ObjectToMidiFile(score)
+        midi_data = io.BytesIO(midi_file.writestr())
+        print("✓ Converted to MIDI")
         
-        try:
-            # MIDIに変換
-            print("Converting to MIDI...")
-            midi_file = midi.translate.music21ObjectToMidiFile(score)
-            midi_file.open(temp_midi_path, 'wb')
-            midi_file.write()
-            midi_file.close()
-            print("✓ Converted to MIDI")
-            
-            # pygame初期化
-            pygame.mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=1024)
-            pygame.mixer.init()
-            
-            # MIDI再生
-            print("🎵 Playing... (Press Ctrl+C to stop)")
-            pygame.mixer.music.load(temp_midi_path)
-            pygame.mixer.music.play()
-            
-            # 再生中は待機
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-            
-            print("✓ Playback finished")
-            
-        finally:
-            # 一時ファイルを削除
-            if os.path.exists(temp_midi_path):
-                os.unlink(temp_midi_path)
+        # pygame初期化
+        pygame.mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=1024)
+        pygame.mixer.init()
+        
+        # 再生終了イベントを受け取るためにイベントキューを初期化
+        # （ウィンドウは開かないので、画面のない環境でも動くようにダミードライバを使う）
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        pygame.display.init()
+        music_end_event = pygame.USEREVENT + 1
+        pygame.mixer.music.set_endevent(music_end_event)
+        
+        # MIDI再生（ファイル名がないので形式をヒントとして渡す）
+        print("🎵 Playing... (Press Ctrl+C to stop)")
+        pygame.mixer.music.load(midi_data, 'mid')
+        pygame.mixer.music.play()
+        
+        # 再生終了イベントまで待機
+        # （タイムアウト付きで待つのは、待機中もCtrl+Cに反応できるようにするため）
+        while True:
+            event = pygame.event.wait(1000)
+            if event.type == music_end_event:
+                break
+            if event.type == pygame.QUIT:
+                raise KeyboardInterrupt
+            if event.type == pygame.NOEVENT and not pygame.mixer.music.get_busy():
+                break
+        
+        print("✓ Playback finished")
             
     except ImportError as e:
         print(f"Error: Missing required package - {e}")
         print("Please install required packages first:")
         print("pip install music21 pygame")
+        print("(or set PIANO_AUTO_INSTALL=1 to install them automatically)")
         return False
     except Exception as e:
         print(f"Error playing file: {e}")
@@ -96,9 +98,11 @@ def main():
         print("Warning: File doesn't appear to be a MusicXML file")
     
     try:
-        # 必要なパッケージをチェック/インストール
-        print("Checking required packages...")
-        install_requirements()
+        # 必要なパッケージのチェック/インストールは PIANO_AUTO_INSTALL=1 のときだけ行う
+        # （毎回の起動でpipを呼ばないようにするため）
+        if os.environ.get('PIANO_AUTO_INSTALL') == '1':
+            print("Checking required packages...")
+            install_requirements()
         
         # ファイルを再生
         success = play_mxl_file(file_path)